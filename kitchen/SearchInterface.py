@@ -1,89 +1,253 @@
 import sqlite3
+import queue
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import pandas as pd
 
+# Business columns a search may name; columns are interpolated into the SQL,
+# so anything else is rejected before a query is built
+_BUSINESS_COLS = frozenset({'organization_id', 'rcNumber', 'approvedName',
+                            'natureOfBusinessFk', 'classificationFk', 'address'})
+# The subset indexed by organizations_fts
+_FTS_COLS = _BUSINESS_COLS - {'organization_id'}
+# Affiliate columns a search may name, checked the same way
+_AFFILIATE_COLS = frozenset({'surname', 'firstname', 'otherName', 'email', 'phoneNumber',
+                             'city', 'occupation', 'corporationName', 'rcNumber', 'address',
+                             'state', 'nationality', 'identityNumber', 'affiliateTypeFk'})
+
+class ConnectionPool:
+    """A fixed-size pool of pre-warmed, read-only SQLite connections."""
+    
+    PRAGMAS = [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA cache_size=-65536",  # 64 MB page cache per connection
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA mmap_size=268435456",  # 256 MB
+        "PRAGMA query_only=1",  # Must come last, journal_mode=WAL writes to the file header
+    ]
+    
+    def __init__(self, db_path: str, pool_size: int = 4, timeout: float = 30.0):
+        """
+        Open pool_size connections up front.
+        
+        Args:
+            db_path: Path to the SQLite database file
+            pool_size: Number of connections to keep open
+            timeout: Seconds to wait for a free connection before giving up
+        """
+        self.db_path = db_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = queue.Queue(maxsize=pool_size)
+        for _ in range(pool_size):
+            self._pool.put(self._create_connection())
+    
+    def _create_connection(self) -> sqlite3.Connection:
+        """Open a connection and apply the read-tuned PRAGMAs."""
+        try:
+            # A larger statement cache keeps every search shape prepared
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            for pragma in self.PRAGMAS:
+                conn.execute(pragma)
+            return conn
+        except sqlite3.Error as e:
+            raise Exception(f"Database connection failed: {e}")
+    
+    @contextmanager
+    def get_connection(self):
+        """Borrow a connection from the pool, returning it when the block exits."""
+        try:
+            conn = self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception(f"No database connection available after {self.timeout} seconds")
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+    
+    def close(self):
+        """Close every connection currently in the pool."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
 class BusinessDataQuerier:
-    def __init__(self, db_path: str):
-        """Initialize the database connection."""
+    """
+    Search businesses and their affiliates.
+    
+    Use as a context manager to close the connection pool it owns on exit:
+    
+        with BusinessDataQuerier('cac-combined.db') as querier:
+            querier.search_by_business("tech", limit=5)
+    """
+    
+    def __init__(self, db_path: str, pool: Optional[ConnectionPool] = None):
+        """
+        Initialize the database connection pool.
+        
+        Args:
+            db_path: Path to the SQLite database file
+            pool: Shared connection pool to use (if None, a single-connection pool is created and owned by this querier)
+        """
         self.db_path = db_path
-        self.conn = None
+        self.pool = pool
+        self._owns_pool = pool is None
         self._connect()
     
     def _connect(self):
-        """Establish database connection."""
-        try:
-            self.conn = sqlite3.connect(self.db_path)
+        """Create the connection pool unless one was supplied."""
+        if self.pool is None:
+            self.pool = ConnectionPool(self.db_path, pool_size=1)
             print("Connected to database successfully!")
-            self.conn.row_factory = sqlite3.Row  # Enable column access by name
-        except sqlite3.Error as e:
-            raise Exception(f"Database connection failed: {e}")
     
-    def search_by_business(self, search_term: str, columns: List[str] = None) -> List[Dict]:
+    # Columns with a NOCASE index, searched by exact and prefix lookups
+    LOOKUP_COLUMNS = ['approvedName', 'rcNumber']
+    
+    # Business + affiliate result row as (expression, alias) pairs, b is the
+    # business and a the affiliate
+    RESULT_COLUMNS = (
+        ('b.id', 'business_id'),
+        ('b.approvedName', 'business_name'),
+        ('b.rcNumber', 'business_number'),
+        ('b.address', 'address'),
+        ('a.id', 'affiliate_id'),
+        ('a.surname', 'surname'),
+        ('a.firstname', 'affiliate_firstname'),
+        ('a.otherName', 'affiliate_othername'),
+        ('a.gender', 'affiliate_gender'),
+        ('a.email', 'affiliate_email'),
+        ('a.phoneNumber', 'affiliate_phone'),
+        ('a.organization_id', 'affiliate_organization_id'),
+        ('a.city', 'affiliate_city'),
+        ('a.occupation', 'affiliate_occupation'),
+    )
+    RESULT_SELECT = ',\n            '.join(f"{expr} AS {alias}" for expr, alias in RESULT_COLUMNS)
+    RESULT_NAMES = ', '.join(alias for _, alias in RESULT_COLUMNS)
+    
+    def search_by_business(self, search_term: str, columns: List[str] = None,
+                           exact: bool = False, limit: Optional[int] = None,
+                           ordered: bool = False) -> List[Dict]:
         """
         Search businesses and return them with their affiliates.
         
+        By default this is a substring search on the organizations_fts trigram
+        index (see scripts/create_search_index.py). The index cannot match
+        terms shorter than 3 characters, so those fall back to a LIKE scan of
+        the table. A term ending in '*' is a prefix search and
+        exact=True is a case-insensitive equality search; both are answered by
+        the NOCASE B-tree indexes on LOOKUP_COLUMNS.
+        
+        Rows come back in index order unless ordered=True, so the order of
+        businesses, and of affiliates within a business, is not stable.
+        Sorting costs a temporary B-tree over the whole result.
+        
         Args:
             search_term: Term to search for in business data
-            columns: Specific business columns to search in (if None, searches common text fields)
+            columns: Specific business columns to search in (if None, searches all indexed text fields)
+            exact: Match the whole column value instead of a substring
+            limit: Maximum number of rows to return (if None, returns all matches)
+            ordered: Sort the rows by business id, then affiliate id
         """
-        if columns is None:
-            # Default searchable columns - adjust based on your schema
-            columns = ['organization_id', 'rcNumber','approvedName', 'natureOfBusinessFk', 'classificationFk', 'address']
-        
-        # Build dynamic WHERE clause
-        where_conditions = []
-        params = []
+        shape, params = self._business_filter(search_term, columns, exact)
+        return self._execute_search(self._build_business_query(shape, ordered), params, limit=limit)
+    
+    def _business_filter(self, search_term: str, columns: List[str] = None, exact: bool = False):
+        """
+        Split a business search into its query shape and params.
         
-        for col in columns:
-            where_conditions.append(f"b.{col} LIKE ?")
-            params.append(f"%{search_term}%")
+        The shape is a hashable (mode, frozenset of columns) pair that fully
+        determines the SQL text. Columns are checked against _BUSINESS_COLS
+        (_FTS_COLS for substring searches), so there is a small, fixed set of
+        shapes and the generated queries can be memoized per shape. Substring
+        searches use the 'fts' mode, or 'like' for terms too short for the
+        trigram index.
+        """
+        lookup = exact or search_term.endswith('*')
+        if columns is not None:
+            invalid = set(columns) - (_BUSINESS_COLS if lookup else _FTS_COLS)
+            if invalid:
+                raise ValueError(f"Unsupported search columns: {sorted(invalid)}")
         
-        where_clause = " OR ".join(where_conditions)
+        if search_term.endswith('*'):
+            prefix = search_term[:-1]
+            # An empty prefix would be LIKE '%' and match every business
+            if not prefix.strip('* '):
+                raise ValueError("Prefix search needs at least one character before '*'")
+            columns = frozenset(columns or self.LOOKUP_COLUMNS)
+            return ('prefix', columns), [f"{self._escape_like(prefix)}%"] * len(columns)
+        if exact:
+            columns = frozenset(columns or self.LOOKUP_COLUMNS)
+            return ('exact', columns), [search_term] * len(columns)
+        if len(search_term) < 3:
+            # The trigram index only matches terms of 3 or more characters
+            columns = frozenset(columns or _FTS_COLS)
+            return ('like', columns), [f"%{self._escape_like(search_term)}%"] * len(columns)
+        return ('fts', frozenset()), [self._build_match_expression(search_term, columns)]
+    
+    @staticmethod
+    def _escape_like(term: str) -> str:
+        """Escape LIKE wildcards so the term matches literally (with ESCAPE '\\')."""
+        for wildcard in ('\\', '%', '_'):
+            term = term.replace(wildcard, '\\' + wildcard)
+        return term
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _business_clauses(shape):
+        """Build the FROM and WHERE clauses matching businesses (aliased b)."""
+        mode, columns = shape
+        if mode == 'fts':
+            return ("organizations_fts f\n        JOIN organizations_old b ON b.entry_id = f.rowid",
+                    "organizations_fts MATCH ?")
         
-        query = f"""
-        SELECT 
-            b.id AS business_id,
-            b.approvedName AS business_name,
-            b.rcNumber AS business_number,
-            b.address,
-            a.id AS affiliate_id,
-            a.surname,
-            a.firstname AS affiliate_firstname,
-            a.otherName AS affiliate_othername,
-            a.gender AS affiliate_gender,
-            a.email AS affiliate_email,
-            a.phoneNumber AS affiliate_phone,
-            a.organization_id AS affiliate_organization_id,
-            a.city AS affiliate_city,
-            a.occupation AS affiliate_occupation
-        FROM organizations_old b
+        # Build dynamic WHERE clause
+        if mode in ('prefix', 'like'):
+            where_conditions = [f"b.{col} LIKE ? ESCAPE '\\'" for col in sorted(columns)]
+        else:
+            where_conditions = [f"b.{col} = ? COLLATE NOCASE" for col in sorted(columns)]
+        return "organizations_old b", " OR ".join(where_conditions)
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _build_business_query(shape, ordered: bool = False) -> str:
+        """Build the business search query for a filter shape."""
+        from_clause, where_clause = BusinessDataQuerier._business_clauses(shape)
+        order_clause = "ORDER BY b.id, a.id" if ordered else ""
+        return f"""
+        SELECT {BusinessDataQuerier.RESULT_SELECT}
+        FROM {from_clause}
         LEFT JOIN affiliates a ON b.organization_id = a.organization_id
         WHERE {where_clause}
-        ORDER BY b.id, a.id
+        {order_clause}
         """
-        
-        return self._execute_search(query, params)
     
-    def search_by_affiliate(self, search_term: str, columns: List[str] = None) -> List[Dict]:
+    @staticmethod
+    def _build_match_expression(search_term: str, columns: List[str] = None) -> str:
+        """Quote the search term as an FTS5 phrase, optionally restricted to columns."""
+        phrase = '"' + search_term.replace('"', '""') + '"'
+        if columns:
+            return f"{{{' '.join(columns)}}} : {phrase}"
+        return phrase
+    
+    def search_by_affiliate(self, search_term: str, columns: List[str] = None,
+                            limit: Optional[int] = None) -> List[Dict]:
         """
         Search affiliates and return associated businesses with all affiliates.
         
+        This is a substring search; a term ending in '*' is a prefix search,
+        as in search_by_business.
+        
         Args:
             search_term: Term to search for in affiliate data
             columns: Specific affiliate columns to search in
+            limit: Maximum number of rows to return (if None, returns all matches)
         """
-        if columns is None:
-            columns = ['affiliate_name', 'affiliate_type', 'contact_info']
-        
-        # Build dynamic WHERE clause
-        where_conditions = []
-        params = []
-        
-        for col in columns:
-            where_conditions.append(f"a.{col} LIKE ?")
-            params.append(f"%{search_term}%")
-        
-        where_clause = " OR ".join(where_conditions)
+        columns, params = self._affiliate_filter(search_term, columns)
+        where_clause = self._affiliate_clause(columns, 'a')
         
         query = f"""
         SELECT DISTINCT
@@ -99,96 +263,156 @@ class BusinessDataQuerier:
         ORDER BY b.id, a2.id
         """
         
-        return self._execute_search(query, params)
+        return self._execute_search(query, params, limit=limit)
+    
+    @staticmethod
+    def _affiliate_filter(search_term: str, columns: List[str] = None):
+        """
+        Split an affiliate search into its column tuple and params.
+        
+        A trailing '*' makes it a prefix search, reading the term the same
+        way _business_filter does. Columns are checked against _AFFILIATE_COLS,
+        so only whitelisted names reach the SQL and the memoized clauses.
+        """
+        if columns is None:
+            columns = ['surname', 'firstname', 'otherName']
+        invalid = set(columns) - _AFFILIATE_COLS
+        if invalid:
+            raise ValueError(f"Unsupported search columns: {sorted(invalid)}")
+        if search_term.endswith('*'):
+            prefix = search_term[:-1]
+            # An empty prefix would be LIKE '%' and match every affiliate
+            if not prefix.strip('* '):
+                raise ValueError("Prefix search needs at least one character before '*'")
+            pattern = f"{BusinessDataQuerier._escape_like(prefix)}%"
+        else:
+            pattern = f"%{BusinessDataQuerier._escape_like(search_term)}%"
+        return tuple(columns), [pattern] * len(columns)
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _affiliate_clause(columns, alias: str) -> str:
+        """Build the WHERE clause matching affiliates under the given alias."""
+        return " OR ".join(f"{alias}.{col} LIKE ? ESCAPE '\\'" for col in columns)
     
     def search_combined(self, search_term: str, business_columns: List[str] = None, 
-                       affiliate_columns: List[str] = None) -> List[Dict]:
+                       affiliate_columns: List[str] = None, limit: Optional[int] = None) -> List[Dict]:
         """
         Search across both business and affiliate data.
-        """
-        business_results = self.search_by_business(search_term, business_columns)
-        affiliate_results = self.search_by_affiliate(search_term, affiliate_columns)
-        
-        # Combine and deduplicate results
-        combined = {}
         
-        for result in business_results + affiliate_results:
-            key = (result['business_id'], result.get('affiliate_id'))
-            if key not in combined:
-                combined[key] = result
+        Both searches run as one UNION ALL query, and rows for the same
+        (business_id, affiliate_id) are reduced to one with ROW_NUMBER(),
+        preferring the business-search row from organizations_old over the
+        affiliate-search row from organizations, so the whole deduplication
+        happens in SQLite.
+        """
+        business_shape, business_params = self._business_filter(search_term, business_columns)
+        affiliate_columns, affiliate_params = self._affiliate_filter(search_term, affiliate_columns)
         
-        return list(combined.values())
+        query = self._build_combined_query(business_shape, affiliate_columns)
+        return self._execute_search(query, business_params + affiliate_params, limit=limit)
+    
+    @staticmethod
+    @lru_cache(maxsize=128)
+    def _build_combined_query(business_shape, affiliate_columns) -> str:
+        """Build the UNION of the business and affiliate searches for a filter shape."""
+        from_clause, business_where = BusinessDataQuerier._business_clauses(business_shape)
+        affiliate_where = BusinessDataQuerier._affiliate_clause(affiliate_columns, 'm')
+        return f"""
+        WITH hits AS (
+            SELECT {BusinessDataQuerier.RESULT_SELECT}, 0 AS src
+            FROM {from_clause}
+            LEFT JOIN affiliates a ON b.organization_id = a.organization_id
+            WHERE {business_where}
+            UNION ALL
+            SELECT {BusinessDataQuerier.RESULT_SELECT}, 1 AS src
+            FROM organizations b
+            INNER JOIN affiliates m ON b.organization_id = m.organization_id
+            LEFT JOIN affiliates a ON b.organization_id = a.organization_id
+            WHERE {affiliate_where}
+        )
+        SELECT {BusinessDataQuerier.RESULT_NAMES}
+        FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY business_id, affiliate_id ORDER BY src) AS rn
+            FROM hits
+        )
+        WHERE rn = 1
+        ORDER BY business_id, affiliate_id
+        """
     
-    def _execute_search(self, query: str, params: List[str]) -> List[Dict]:
-        """Execute search query and return results."""
+    def _execute_search(self, query: str, params: List[str], limit: Optional[int] = None) -> List[Dict]:
+        """
+        Execute search query and return results.
+        
+        A limit is bound as a parameter so the SQL text, and its prepared
+        statement, stay the same for every limit value.
+        """
+        if limit is not None:
+            query += " LIMIT ?"
+            params = list(params) + [int(limit)]
         try:
-            cursor = self.conn.execute(query, params)
-            results = cursor.fetchall()
-            return [dict(row) for row in results]
+            with self.pool.get_connection() as conn:
+                cursor = conn.execute(query, params)
+                keys = tuple(d[0] for d in cursor.description)
+                # Plain tuples zipped with the column names, streamed from the cursor
+                return [dict(zip(keys, row)) for row in cursor]
         except sqlite3.Error as e:
             raise Exception(f"Query execution failed: {e}")
     
     def get_business_with_affiliates(self, business_id: int) -> Dict[str, Any]:
-        """Get complete business profile with all affiliates."""
-        query = """
-        SELECT 
-            b.*,
-            a.affiliate_id,
-            a.affiliate_name,
-            a.affiliate_type,
-            a.contact_info
-        FROM business b
-        LEFT JOIN affiliates a ON b.business_id = a.business_id
-        WHERE b.business_id = ?
-        ORDER BY a.affiliate_id
         """
+        Get complete business profile with all affiliates.
         
-        results = self._execute_search(query, [business_id])
+        The business row and its affiliates are fetched separately, so the
+        business columns are not repeated on every affiliate row.
+        """
+        business_query = "SELECT * FROM business WHERE business_id = ?"
+        business = self._execute_search(business_query, [business_id], limit=1)
         
-        if not results:
+        if not business:
             return None
         
-        # Structure the response
-        business_data = {k: v for k, v in results[0].items() 
-                        if not k.startswith('affiliate_')}
-        
-        affiliates = []
-        for row in results:
-            if row['affiliate_id']:
-                affiliate = {k: v for k, v in row.items() 
-                           if k.startswith('affiliate_')}
-                affiliates.append(affiliate)
+        affiliates_query = """
+        SELECT affiliate_id, affiliate_name, affiliate_type, contact_info
+        FROM affiliates
+        WHERE business_id = ?
+        ORDER BY affiliate_id
+        """
+        affiliates = self._execute_search(affiliates_query, [business_id])
         
         return {
-            'business': business_data,
+            'business': business[0],
             'affiliates': affiliates
         }
     
     def close(self):
-        """Close database connection."""
-        if self.conn:
-            self.conn.close()
+        """Close the connection pool if this querier created it."""
+        if self.pool and self._owns_pool:
+            self.pool.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 # Example usage
 def main():
     # Initialize the querier
     # querier = BusinessDataQuerier('datasrc/cac-data-contd-32.db')
-    querier = BusinessDataQuerier('cac-combined.db')
-
-    
-    try:
+    with BusinessDataQuerier('cac-combined.db') as querier:
         # Search examples
         print("=== Search by Business Name ===")
-        results = querier.search_by_business("tech", ['business_name'])
-        for result in results[:5]:  # Show first 5 results
+        results = querier.search_by_business("tech", ['approvedName'], limit=5)
+        for result in results:  # Show first 5 results
             print(f"Business: {result.get('business_name')} | "
                   f"Affiliate: {result.get('affiliate_name', 'None')}")
         
         print("\n=== Search by Affiliate Type ===")
-        results = querier.search_by_affiliate("supplier", ['affiliate_type'])
-        for result in results[:5]:
+        results = querier.search_by_affiliate("supplier", ['occupation'], limit=5)
+        for result in results:
             print(f"Business: {result.get('business_name')} | "
-                  f"Affiliate: {result.get('affiliate_name')} ({result.get('affiliate_type')})")
+                  f"Affiliate: {result.get('affiliate_name')} ({result.get('affiliate_email')})")
         
         print("\n=== Combined Search ===")
         results = querier.search_combined("consulting")
@@ -199,22 +423,19 @@ def main():
         if business_profile:
             print(f"Business: {business_profile['business']}")
             print(f"Number of affiliates: {len(business_profile['affiliates'])}")
-    
-    finally:
-        querier.close()
 
 if __name__ == "__main__":
-    # test_querier = BusinessDataQuerier('datasrc/cac-data-contd-32.db')
-    test_querier = BusinessDataQuerier('cac-combined.db')
-    # test_querier
-    print("=== Search by Business Name ===")
-    results = test_querier.search_by_business("tech")
-    # results = test_querier.search_by_business("Agridev")
+    # with BusinessDataQuerier('datasrc/cac-data-contd-32.db') as test_querier:
+    with BusinessDataQuerier('cac-combined.db') as test_querier:
+        # test_querier
+        print("=== Search by Business Name ===")
+        results = test_querier.search_by_business("tech", limit=5)
+        # results = test_querier.search_by_business("Agridev", limit=5)
 
-    for result in results[:]:  # Show first 5 results
-        # print(result.keys())
-        print(f"Business: {result.get('business_name')}  {result.get('business_id')}| "
-                f"Affiliate: {result.get('surname', 'None')} {result.get('affiliate_firstname', '-')} {result.get('affiliate_othername', '-')}")
+        for result in results:  # Show first 5 results
+            # print(result.keys())
+            print(f"Business: {result.get('business_name')}  {result.get('business_id')}| "
+                    f"Affiliate: {result.get('surname', 'None')} {result.get('affiliate_firstname', '-')} {result.get('affiliate_othername', '-')}")
         
   
     
@@ -1,20 +1,18 @@
 import time
 import pandas as pd
 import sqlite3
+from contextlib import closing
 
-conn = sqlite3.connect('cac-combined.db')
+with closing(sqlite3.connect('cac-combined.db')) as conn:
+    print("Started analysis..")
+    query= "SELECT * FROM organizations_old"
 
-print("Started analysis..")
-query= "SELECT * FROM organizations_old"
+    start = time.time()
+    # df = pd.read_sql_query(query, conn)
+    print("Pandas load time:", time.time() - start)
 
-start = time.time()
-# df = pd.read_sql_query(query, conn)
-print("Pandas load time:", time.time() - start)
-
-start = time.time()
-cursor = conn.execute(query)
-rows = cursor.fetchall()
-print("Direct query time:", time.time() - start)
-
-conn.close()
+    start = time.time()
+    cursor = conn.execute(query)
+    rows = cursor.fetchall()
+    print("Direct query time:", time.time() - start)
 
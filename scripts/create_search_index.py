@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Script to build the full-text search, lookup and join indexes used by BusinessDataQuerier.
+Usage: python create_search_index.py <database_path> [--rebuild]
+        python scripts/create_search_index.py datasrc/cac-combined.db
+Rebuilding the source table (e.g. with drop_columns.py) drops the sync
+triggers and indexes, so re-run this script with --rebuild afterwards.
+"""
+
+import sqlite3
+import sys
+import os
+import time
+import argparse
+from contextlib import closing
+
+SOURCE_TABLE = "organizations_old"
+FTS_TABLE = "organizations_fts"
+FTS_COLUMNS = ['approvedName', 'rcNumber', 'address', 'natureOfBusinessFk', 'classificationFk']
+# INTEGER PRIMARY KEY linking FTS rows to source rows; unlike an implicit
+# rowid it is not renumbered by VACUUM
+CONTENT_ROWID = 'entry_id'
+# NOCASE indexes backing exact and prefix lookups (LIKE only uses a NOCASE index)
+LOOKUP_INDEXES = {
+    'idx_org_approvedName': 'approvedName',
+    'idx_org_rcNumber': 'rcNumber',
+}
+# Indexes on the business/affiliate join key, so the joins seek instead of scanning
+JOIN_INDEXES = {
+    'idx_affiliates_org': ('affiliates', 'organization_id'),
+    'idx_organizations_org': (SOURCE_TABLE, 'organization_id'),
+}
+JOIN_PLAN_QUERY = f"""
+SELECT b.id, a.id FROM {SOURCE_TABLE} b
+LEFT JOIN affiliates a ON b.organization_id = a.organization_id
+"""
+
+def fts_exists(cursor):
+    """Check whether the FTS table has already been created."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (FTS_TABLE,))
+    return cursor.fetchone() is not None
+
+def has_content_rowid(cursor):
+    """Check that CONTENT_ROWID is the INTEGER PRIMARY KEY of the source table."""
+    cursor.execute(f"PRAGMA table_info({SOURCE_TABLE})")
+    pk_cols = [(row[1], row[2].upper()) for row in cursor.fetchall() if row[5] > 0]  # name, type
+    return pk_cols == [(CONTENT_ROWID, 'INTEGER')]
+
+def create_fts_table(cursor):
+    """
+    Create the external-content FTS5 table and the triggers that keep it in sync.
+
+    The trigram tokenizer indexes every 3-character sequence, so substring
+    searches (the old LIKE '%term%') are answered from the index. The FTS
+    rowid is the source table's CONTENT_ROWID.
+    """
+    cols = ', '.join(FTS_COLUMNS)
+    new_cols = ', '.join(f"new.{col}" for col in FTS_COLUMNS)
+    old_cols = ', '.join(f"old.{col}" for col in FTS_COLUMNS)
+
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        {cols},
+        content='{SOURCE_TABLE}',
+        content_rowid='{CONTENT_ROWID}',
+        tokenize='trigram'
+    )
+    """)
+
+    cursor.execute(f"""
+    CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {SOURCE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {cols}) VALUES (new.{CONTENT_ROWID}, {new_cols});
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {SOURCE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {cols}) VALUES ('delete', old.{CONTENT_ROWID}, {old_cols});
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE ON {SOURCE_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {cols}) VALUES ('delete', old.{CONTENT_ROWID}, {old_cols});
+        INSERT INTO {FTS_TABLE}(rowid, {cols}) VALUES (new.{CONTENT_ROWID}, {new_cols});
+    END
+    """)
+
+def drop_fts_table(cursor):
+    """Drop the FTS table and its sync triggers."""
+    for suffix in ('ai', 'ad', 'au'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+    cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+def populate_fts_table(cursor):
+    """One-time copy of the existing rows into the FTS index."""
+    cols = ', '.join(FTS_COLUMNS)
+    cursor.execute(f"""
+    INSERT INTO {FTS_TABLE}(rowid, {cols})
+    SELECT {CONTENT_ROWID}, {cols} FROM {SOURCE_TABLE}
+    """)
+    return cursor.rowcount
+
+def create_lookup_indexes(cursor):
+    """Create the B-tree indexes used for exact and prefix lookups."""
+    for index_name, col in LOOKUP_INDEXES.items():
+        print(f"Creating index '{index_name}' on {SOURCE_TABLE}({col} COLLATE NOCASE)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {SOURCE_TABLE}({col} COLLATE NOCASE)")
+
+def create_join_indexes(cursor):
+    """Create the indexes on the join key, skipping tables that do not exist."""
+    for index_name, (table, col) in JOIN_INDEXES.items():
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        if not cursor.fetchone():
+            print(f"Skipping index '{index_name}': table '{table}' does not exist")
+            continue
+        print(f"Creating index '{index_name}' on {table}({col})")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table}({col})")
+
+def print_join_plan(cursor):
+    """Print the query plan of the business/affiliate join (expect SEARCH ... USING INDEX, not SCAN)."""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='affiliates'")
+    if not cursor.fetchone():
+        return
+    cursor.execute(f"EXPLAIN QUERY PLAN {JOIN_PLAN_QUERY}")
+    print("Join query plan:")
+    for row in cursor.fetchall():
+        print(f"  {row[3]}")  # Plan detail is at index 3
+
+def create_search_index(db_path, rebuild=False):
+    """
+    Create and populate the FTS index, lookup indexes and join indexes.
+
+    Args:
+        db_path: Path to the SQLite database file
+        rebuild: Drop and recreate the index if it already exists
+    """
+    with closing(sqlite3.connect(db_path, timeout=600)) as conn:
+        cursor = conn.cursor()
+
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (SOURCE_TABLE,))
+        if not cursor.fetchone():
+            print(f"Error: Table '{SOURCE_TABLE}' does not exist in the database.")
+            return False
+
+        if not has_content_rowid(cursor):
+            print(f"Error: '{CONTENT_ROWID}' is not the INTEGER PRIMARY KEY of '{SOURCE_TABLE}'.")
+            return False
+
+        try:
+            start_time = time.time()
+
+            # The connection context commits on success and rolls back on error.
+            # Python only opens a transaction implicitly before DML, so begin one
+            # explicitly, otherwise the DDL below would commit on its own
+            with conn:
+                conn.execute("BEGIN")
+                if fts_exists(cursor) and not rebuild:
+                    print(f"Index '{FTS_TABLE}' already exists. Use --rebuild to recreate it.")
+                else:
+                    if fts_exists(cursor):
+                        print(f"Dropping existing index '{FTS_TABLE}'")
+                        drop_fts_table(cursor)
+
+                    print(f"Creating FTS5 index '{FTS_TABLE}' on {SOURCE_TABLE}({', '.join(FTS_COLUMNS)})")
+                    create_fts_table(cursor)
+                    indexed_rows = populate_fts_table(cursor)
+                    print(f"Indexed {indexed_rows:,} rows")
+
+                create_lookup_indexes(cursor)
+                create_join_indexes(cursor)
+
+            # Refresh planner statistics so the new indexes are chosen
+            with conn:
+                print("Running ANALYZE")
+                cursor.execute("ANALYZE")
+            print_join_plan(cursor)
+
+            total_time = time.time() - start_time
+            print(f"Search indexes ready in {total_time:.2f} seconds")
+
+        except Exception as e:
+            print(f"Error occurred: {str(e)}")
+            return False
+
+    return True
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description="Build the search indexes for business searches")
+    parser.add_argument("db_path", help="Path to the SQLite database file")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Drop and recreate the index if it already exists")
+
+    args = parser.parse_args()
+
+    # Check if database file exists
+    if not os.path.isfile(args.db_path):
+        print(f"Error: Database file '{args.db_path}' does not exist.")
+        sys.exit(1)
+
+    success = create_search_index(args.db_path, rebuild=args.rebuild)
+    if not success:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,181 @@
 #!/usr/bin/env python3
 """
 Script to drop all columns from a table except those specified in a file.
-Usage: python drop_columns.py <database_path> <table_name> [--batch-size=N] [--backup]
-        python scripts/drop_columns.py datasrc/cac-combined.db affiliates --batch-size=10000 --backup --columns-file=fixtures/affiliates_columns.txt
+Usage: python drop_columns.py <database_path> <table_name> [--batched] [--batch-size=N] [--in-place] [--backup]
+        python scripts/drop_columns.py datasrc/cac-combined.db affiliates --backup --columns-file=fixtures/affiliates_columns.txt
+Rebuilding the table drops its indexes and triggers; for organizations_old,
+re-run create_search_index.py --rebuild afterwards.
 """
 
 import sqlite3
 import sys
 import os
 import time
-import shutil
 import argparse
+from contextlib import closing
 from datetime import datetime
 
+def quote_identifier(ident):
+    """Quote a table or column name for interpolation into SQL."""
+    return '"' + ident.replace('"', '""') + '"'
+
 def read_columns_to_keep(file_path):
     """Read the list of columns to keep from a file."""
     with open(file_path, 'r') as f:
         columns = [line.strip() for line in f if line.strip()]
     return columns
 
-def get_current_columns(cursor, table_name):
-    """Get all columns in the specified table."""
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    return [row[1] for row in cursor.fetchall()]  # Column name is at index 1
+def print_backup_progress(status, remaining, total):
+    """Progress callback for sqlite3.Connection.backup."""
+    print(f"Backing up: {total - remaining:,}/{total:,} pages", end='\r')
 
 def create_backup(db_path):
-    """Create a backup of the database file."""
+    """
+    Create a backup of the database using SQLite's online backup API.
+    
+    Unlike a file copy this only reads live pages, and is consistent even
+    with WAL enabled or another connection writing. Copying 1000 pages per
+    step lets concurrent writers in between steps.
+    """
     backup_path = f"{db_path}.backup-{datetime.now().strftime('%Y%m%d%H%M%S')}"
     try:
-        shutil.copy2(db_path, backup_path)
-        print(f"Created backup at: {backup_path}")
+        src = sqlite3.connect(db_path)
+        dst = sqlite3.connect(backup_path)
+        try:
+            src.backup(dst, pages=1000, progress=print_backup_progress)
+        finally:
+            dst.close()
+            src.close()
+        print(f"\nCreated backup at: {backup_path}")
         return True
     except Exception as e:
         print(f"Failed to create backup: {str(e)}")
         return False
 
+# Offline tuning for the single-transaction bulk copy. The rollback journal
+# stays on so a failed copy (e.g. disk full) rolls back cleanly; pages appended
+# past the original end of the file are not journaled, so it costs little.
+BULK_COPY_PRAGMAS = {
+    'synchronous': 'OFF',
+    'cache_size': -1048576,  # 1 GB page cache
+    'temp_store': 'MEMORY',
+}
+
+# Minimum seconds between progress lines, and SQLite VM instructions between
+# progress handler calls during the bulk copy
+PROGRESS_INTERVAL = 0.5
+PROGRESS_OPCODES = 1_000_000
+
+# First SQLite release with ALTER TABLE ... DROP COLUMN
+DROP_COLUMN_MIN_VERSION = (3, 35, 0)
+
+def bulk_copy_progress_handler(start_time):
+    """Build a progress handler that reports elapsed time at most every PROGRESS_INTERVAL seconds."""
+    last_print = time.monotonic()
+
+    def report():
+        nonlocal last_print
+        now = time.monotonic()
+        if now - last_print > PROGRESS_INTERVAL:
+            last_print = now
+            print(f"Copying rows... {time.time() - start_time:.1f} seconds elapsed", end='\r')
+        return 0  # Non-zero would abort the statement
+
+    return report
+
+def apply_pragmas(cursor, pragmas):
+    """Set the given PRAGMAs and return their previous values."""
+    previous = {}
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}")
+        previous[name] = cursor.fetchone()[0]
+        cursor.execute(f"PRAGMA {name} = {value}")
+    return previous
+
+def swap_tables(cursor, new_table, table_name):
+    """Drop the old table and rename the new table to take its place."""
+    # Drop the old table
+    drop_stmt = f"DROP TABLE {quote_identifier(table_name)}"
+    print(f"Dropping old table: {drop_stmt}")
+    cursor.execute(drop_stmt)
+    
+    # Rename the new table to the original name
+    rename_stmt = f"ALTER TABLE {quote_identifier(new_table)} RENAME TO {quote_identifier(table_name)}"
+    print(f"Renaming new table: {rename_stmt}")
+    cursor.execute(rename_stmt)
+
+def bulk_rebuild_table(conn, create_stmt, new_table, table_name, columns):
+    """
+    Create the new table and copy every row into it in one transaction, then swap it in.
+    
+    SQLite streams the source table sequentially, avoiding the per-batch
+    seeks and commits of the batched copy. The copy runs with
+    BULK_COPY_PRAGMAS; the drop and rename run in a second transaction with
+    the previous settings restored. A failure in either rolls back and
+    leaves the original table in place. Returns the number of rows copied.
+    """
+    cursor = conn.cursor()
+    previous_pragmas = apply_pragmas(cursor, BULK_COPY_PRAGMAS)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        print(f"Creating new table with statement: {create_stmt}")
+        cursor.execute(create_stmt)
+        # Report progress from inside SQLite while the single INSERT runs
+        conn.set_progress_handler(bulk_copy_progress_handler(time.time()), PROGRESS_OPCODES)
+        select_cols = ', '.join(quote_identifier(col) for col in columns)
+        cursor.execute(f"INSERT INTO {quote_identifier(new_table)} SELECT {select_cols} FROM {quote_identifier(table_name)}")
+        copied_rows = cursor.rowcount if cursor.rowcount >= 0 else 0
+        conn.set_progress_handler(None, PROGRESS_OPCODES)
+        print("\nFinished copying data to new table")
+        conn.commit()
+    except Exception:
+        # End the transaction first, PRAGMAs like synchronous cannot change inside one
+        conn.rollback()
+        raise
+    finally:
+        conn.set_progress_handler(None, PROGRESS_OPCODES)
+        apply_pragmas(cursor, previous_pragmas)
+    
+    # Swap the tables with the previous settings restored
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        swap_tables(cursor, new_table, table_name)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return copied_rows
+
+def drop_columns_in_place(conn, table_name, columns_to_drop):
+    """
+    Drop the columns with ALTER TABLE ... DROP COLUMN in a single transaction.
+    
+    SQLite rewrites every row once per dropped column, so this is only faster
+    than the rebuild when a few columns are dropped. It does not save disk
+    space either: the rollback journal (or WAL) holds the before-image of the
+    whole table, so peak extra disk is about the table's size, as with the
+    rebuild. Raises sqlite3.OperationalError (after rolling back) when a
+    column cannot be dropped this way, e.g. it is a key or indexed column.
+    """
+    cursor = conn.cursor()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for col in columns_to_drop:
+            drop_stmt = f"ALTER TABLE {quote_identifier(table_name)} DROP COLUMN {quote_identifier(col)}"
+            print(f"Dropping column: {drop_stmt}")
+            cursor.execute(drop_stmt)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
 def count_rows(cursor, table_name):
     """Count the number of rows in a table."""
-    cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+    cursor.execute(f"SELECT COUNT(*) FROM {quote_identifier(table_name)}")
     return cursor.fetchone()[0]
  
-def drop_unused_columns(db_path, table_name, columns_to_keep, batch_size=5000, create_backup_file=False):
+def drop_unused_columns(db_path, table_name, columns_to_keep, batch_size=5000, create_backup_file=False,
+                        batched=False, in_place=False):
     """
     Drop all columns from a table except those specified.
     
@@ -48,8 +183,13 @@ def drop_unused_columns(db_path, table_name, columns_to_keep, batch_size=5000, c
         db_path: Path to the SQLite database file
         table_name: Name of the table to modify
         columns_to_keep: List of column names to keep
-        batch_size: Number of rows to process in each batch
+        batch_size: Number of rows to process in each batch (only used when batched)
         create_backup_file: Whether to create a backup of the database before proceeding
+        batched: Copy rows in separately committed batches instead of one transaction,
+                 for tables too large to copy in a single transaction
+        in_place: Drop the columns with ALTER TABLE ... DROP COLUMN (SQLite 3.35+)
+                  instead of rebuilding the table, falling back to the rebuild
+                  when that is not possible. Not combined with batched.
     """
     # Create a backup if requested
     if create_backup_file:
@@ -58,162 +198,185 @@ def drop_unused_columns(db_path, table_name, columns_to_keep, batch_size=5000, c
             return False
     
     # Set a higher timeout for large operations (default is 5 seconds)
-    conn = sqlite3.connect(db_path, timeout=600)
-    cursor = conn.cursor()
-    
-    # Enable foreign keys if they're being used
-    cursor.execute("PRAGMA foreign_keys = OFF")
-    
-    # Check if table exists
-    cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-    if not cursor.fetchone():
-        print(f"Error: Table '{table_name}' does not exist in the database.")
-        conn.close()
-        return False
-    
-    # Get current columns in the table
-    current_columns = get_current_columns(cursor, table_name)
-    print(f"Current columns in {table_name}: {current_columns}")
-    
-    # Filter columns_to_keep to only include columns that actually exist
-    valid_columns = [col for col in columns_to_keep if col in current_columns]
-    print(f"Columns to keep: {valid_columns}")
-    
-    # Columns to drop
-    columns_to_drop = [col for col in current_columns if col not in columns_to_keep]
-    print(f"Columns to drop: {columns_to_drop}")
-    
-    if not columns_to_drop:
-        print("No columns to drop.")
-        conn.close()
-        return True
-    
-    # Count total rows
-    total_rows = count_rows(cursor, table_name)
-    print(f"Total rows to process: {total_rows:,}")
-    
-    # Create a new table with only the columns to keep
-    column_defs = []
-    # Get all column information at once to reduce queries
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    table_info = {row[1]: row for row in cursor.fetchall()}  # Map column names to their info
-    
-    for col in valid_columns:
-        if col in table_info:
-            row = table_info[col]
-            col_name = row[1]
-            col_type = row[2]  # Data type is at index 2
-            not_null = "NOT NULL" if row[3] == 1 else ""  # NOT NULL constraint is at index 3
-            default_val = f"DEFAULT {row[4]}" if row[4] is not None else ""  # Default value is at index 4
-            is_pk = "PRIMARY KEY" if row[5] == 1 else ""  # Primary key flag is at index 5
-            column_defs.append(f"{col_name} {col_type} {not_null} {default_val} {is_pk}".strip())
-    
-    # Get primary key info
-    cursor.execute(f"PRAGMA table_info({table_name})")
-    primary_key_cols = [row[1] for row in cursor.fetchall() if row[5] > 0]  # Primary key columns
-    
-    # Generate and execute SQL for creating new table and copying data
-    try:
-        # Start with turning off autocommit
-        conn.isolation_level = 'DEFERRED'
+    with closing(sqlite3.connect(db_path, timeout=600)) as conn:
+        cursor = conn.cursor()
         
-        # Create a new table with only the columns we want to keep
-        new_table = f"{table_name}_new"
-        create_stmt = f"CREATE TABLE {new_table} ({', '.join(column_defs)})"
-        print(f"Creating new table with statement: {create_stmt}")
-        cursor.execute(create_stmt)
+        # Enable foreign keys if they're being used
+        cursor.execute("PRAGMA foreign_keys = OFF")
         
-        # Get a column to use for batching (prefer primary key, otherwise use first column)
-        batch_column = primary_key_cols[0] if primary_key_cols and primary_key_cols[0] in valid_columns else valid_columns[0]
+        # Check if table exists
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,))
+        if not cursor.fetchone():
+            print(f"Error: Table '{table_name}' does not exist in the database.")
+            return False
         
-        # Process data in batches
-        print(f"Starting data migration in batches of {batch_size:,} rows")
-        print(f"Using column '{batch_column}' for batching")
+        # Get all column information at once: cid, name, type, notnull, dflt_value, pk
+        cursor.execute(f"PRAGMA table_info({quote_identifier(table_name)})")
+        table_rows = cursor.fetchall()
+        table_info = {row[1]: row for row in table_rows}  # Map column names to their info
+        primary_key_cols = [row[1] for row in table_rows if row[5] > 0]  # Primary key columns
         
-        start_time = time.time()
-        processed_rows = 0
+        # Get current columns in the table
+        current_columns = [row[1] for row in table_rows]  # Column name is at index 1
+        print(f"Current columns in {table_name}: {current_columns}")
         
-        # First get min and max values for batching
-        cursor.execute(f"SELECT MIN({batch_column}), MAX({batch_column}) FROM {table_name}")
-        min_id, max_id = cursor.fetchone()
+        # Filter columns_to_keep to only include columns that actually exist
+        valid_columns = [col for col in columns_to_keep if col in current_columns]
+        print(f"Columns to keep: {valid_columns}")
         
-        if min_id is not None and max_id is not None:
-            current_min = min_id
-            
-            while current_min <= max_id:
-                current_max = current_min + batch_size - 1
-                
-                # Begin transaction for this batch
-                conn.execute("BEGIN TRANSACTION")
-                
-                # Copy data for this batch
-                batch_insert_stmt = f"""
-                INSERT INTO {new_table} 
-                SELECT {', '.join(valid_columns)} FROM {table_name} 
-                WHERE {batch_column} >= ? AND {batch_column} <= ?
-                """
-                cursor.execute(batch_insert_stmt, (current_min, current_max))
-                
-                # Get number of rows inserted in this batch
-                batch_rows = cursor.rowcount if cursor.rowcount >= 0 else 0
-                processed_rows += batch_rows
-                
-                # Commit this batch
-                conn.commit()
-                
-                # Update progress
-                percent_complete = (processed_rows / total_rows) * 100 if total_rows > 0 else 0
-                elapsed_time = time.time() - start_time
-                rows_per_sec = processed_rows / elapsed_time if elapsed_time > 0 else 0
-                est_remaining = (total_rows - processed_rows) / rows_per_sec if rows_per_sec > 0 else 0
-                
-                print(f"Progress: {processed_rows:,}/{total_rows:,} rows ({percent_complete:.2f}%) - {rows_per_sec:.1f} rows/sec - Est. remaining: {est_remaining:.1f} seconds", end='\r')
-                
-                # Move to next batch
-                current_min = current_max + 1
-        
-        print("\nFinished copying data to new table")
+        # Columns to drop
+        columns_to_drop = [col for col in current_columns if col not in columns_to_keep]
+        print(f"Columns to drop: {columns_to_drop}")
         
-        # Begin final transaction
-        conn.execute("BEGIN TRANSACTION")
+        if not columns_to_drop:
+            print("No columns to drop.")
+            return True
         
-        # Drop the old table
-        drop_stmt = f"DROP TABLE {table_name}"
-        print(f"Dropping old table: {drop_stmt}")
-        cursor.execute(drop_stmt)
+        # Drop the columns in place when requested and SQLite supports it
+        if in_place and batched:
+            print("Batched copy requested, rebuilding the table instead of dropping columns in place")
+        elif in_place and sqlite3.sqlite_version_info < DROP_COLUMN_MIN_VERSION:
+            print(f"SQLite {sqlite3.sqlite_version} cannot drop columns in place, rebuilding the table instead")
+        elif in_place:
+            try:
+                start_time = time.time()
+                drop_columns_in_place(conn, table_name, columns_to_drop)
+                total_time = time.time() - start_time
+                print(f"Successfully dropped {len(columns_to_drop)} columns from {table_name} in {total_time:.2f} seconds.")
+                cursor.execute("PRAGMA foreign_keys = ON")
+                return True
+            except sqlite3.OperationalError as e:
+                print(f"Cannot drop columns in place ({str(e)}), rebuilding the table instead")
         
-        # Rename the new table to the original name
-        rename_stmt = f"ALTER TABLE {new_table} RENAME TO {table_name}"
-        print(f"Renaming new table: {rename_stmt}")
-        cursor.execute(rename_stmt)
+        # Indexes and triggers on the table, which the rebuild does not carry over
+        cursor.execute("SELECT type, name FROM sqlite_master "
+                       "WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL", (table_name,))
+        dependents = cursor.fetchall()
         
-        # Commit the final transaction
-        conn.commit()
-        
-        # Calculate and display metrics
-        total_time = time.time() - start_time
-        print(f"Successfully dropped {len(columns_to_drop)} columns from {table_name}.")
-        print(f"Processed {processed_rows:,} rows in {total_time:.2f} seconds ({processed_rows/total_time:.1f} rows/sec)")
+        # Count total rows
+        total_rows = count_rows(cursor, table_name)
+        print(f"Total rows to process: {total_rows:,}")
         
-    except Exception as e:
-        # If anything goes wrong, rollback
-        conn.rollback()
-        print(f"Error occurred: {str(e)}")
-        conn.close()
-        return False
+        # Create a new table with only the columns to keep
+        column_defs = []
+        for col in valid_columns:
+            if col in table_info:
+                row = table_info[col]
+                col_name = row[1]
+                col_type = row[2]  # Data type is at index 2
+                not_null = "NOT NULL" if row[3] == 1 else ""  # NOT NULL constraint is at index 3
+                default_val = f"DEFAULT {row[4]}" if row[4] is not None else ""  # Default value is at index 4
+                is_pk = "PRIMARY KEY" if row[5] == 1 else ""  # Primary key flag is at index 5
+                column_defs.append(f"{quote_identifier(col_name)} {col_type} {not_null} {default_val} {is_pk}".strip())
         
-    # Re-enable foreign keys
-    cursor.execute("PRAGMA foreign_keys = ON")
-    conn.close()
-    return True
+        # Generate and execute SQL for creating new table and copying data
+        try:
+            # The connection context commits on success and rolls back on error
+            with conn:
+                # Start with turning off autocommit
+                conn.isolation_level = 'DEFERRED'
+                
+                # Create a new table with only the columns we want to keep
+                new_table = f"{table_name}_new"
+                create_stmt = f"CREATE TABLE {quote_identifier(new_table)} ({', '.join(column_defs)})"
+                
+                start_time = time.time()
+                
+                if not batched:
+                    print("Copying all rows to the new table in a single transaction")
+                    processed_rows = bulk_rebuild_table(conn, create_stmt, new_table, table_name, valid_columns)
+                else:
+                    print(f"Creating new table with statement: {create_stmt}")
+                    cursor.execute(create_stmt)
+                    
+                    # Get a column to use for batching (prefer primary key, otherwise use first column)
+                    batch_column = primary_key_cols[0] if primary_key_cols and primary_key_cols[0] in valid_columns else valid_columns[0]
+                    
+                    # Process data in batches
+                    print(f"Starting data migration in batches of {batch_size:,} rows")
+                    print(f"Using column '{batch_column}' for batching")
+                    
+                    processed_rows = 0
+                    last_print = time.monotonic()
+                    
+                    # First get min and max values for batching
+                    cursor.execute(f"SELECT MIN({quote_identifier(batch_column)}), MAX({quote_identifier(batch_column)}) "
+                                   f"FROM {quote_identifier(table_name)}")
+                    min_id, max_id = cursor.fetchone()
+                    
+                    if min_id is not None and max_id is not None:
+                        current_min = min_id
+                        
+                        while current_min <= max_id:
+                            current_max = current_min + batch_size - 1
+                            
+                            # Begin transaction for this batch
+                            conn.execute("BEGIN TRANSACTION")
+                            
+                            # Copy data for this batch
+                            batch_insert_stmt = f"""
+                            INSERT INTO {quote_identifier(new_table)} 
+                            SELECT {', '.join(quote_identifier(col) for col in valid_columns)} FROM {quote_identifier(table_name)} 
+                            WHERE {quote_identifier(batch_column)} >= ? AND {quote_identifier(batch_column)} <= ?
+                            """
+                            cursor.execute(batch_insert_stmt, (current_min, current_max))
+                            
+                            # Get number of rows inserted in this batch
+                            batch_rows = cursor.rowcount if cursor.rowcount >= 0 else 0
+                            processed_rows += batch_rows
+                            
+                            # Commit this batch
+                            conn.commit()
+                            
+                            # Update progress, at most once per PROGRESS_INTERVAL
+                            now = time.monotonic()
+                            if now - last_print > PROGRESS_INTERVAL:
+                                last_print = now
+                                percent_complete = (processed_rows / total_rows) * 100 if total_rows > 0 else 0
+                                elapsed_time = time.time() - start_time
+                                rows_per_sec = processed_rows / elapsed_time if elapsed_time > 0 else 0
+                                est_remaining = (total_rows - processed_rows) / rows_per_sec if rows_per_sec > 0 else 0
+                                
+                                print(f"Progress: {processed_rows:,}/{total_rows:,} rows ({percent_complete:.2f}%) - {rows_per_sec:.1f} rows/sec - Est. remaining: {est_remaining:.1f} seconds", end='\r')
+                            
+                            # Move to next batch
+                            current_min = current_max + 1
+                    
+                    print("\nFinished copying data to new table")
+                    
+                    # Begin final transaction
+                    conn.execute("BEGIN TRANSACTION")
+                    swap_tables(cursor, new_table, table_name)
+            
+            # Calculate and display metrics
+            total_time = time.time() - start_time
+            print(f"Successfully dropped {len(columns_to_drop)} columns from {table_name}.")
+            print(f"Processed {processed_rows:,} rows in {total_time:.2f} seconds ({processed_rows/total_time:.1f} rows/sec)")
+            if dependents:
+                print(f"Warning: the rebuild dropped {', '.join(f'{kind} {name}' for kind, name in dependents)}. "
+                      "Recreate them, e.g. re-run create_search_index.py --rebuild for the search indexes.")
+            
+        except Exception as e:
+            print(f"Error occurred: {str(e)}")
+            return False
+            
+        # Re-enable foreign keys, only once the rebuild is committed
+        cursor.execute("PRAGMA foreign_keys = ON")
+        return True
 
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description="Drop unused columns from a SQLite database table")
     parser.add_argument("db_path", help="Path to the SQLite database file")
     parser.add_argument("table_name", help="Name of the table to modify")
+    parser.add_argument("--batched", action="store_true",
+                        help="Copy rows in separately committed batches instead of a single bulk transaction")
     parser.add_argument("--batch-size", type=int, default=5000, 
-                        help="Number of rows to process in each batch (default: 5000)")
+                        help="Number of rows to process in each batch when --batched (default: 5000)")
+    parser.add_argument("--in-place", action="store_true",
+                        help="Drop columns with ALTER TABLE ... DROP COLUMN (SQLite 3.35+) instead of rebuilding "
+                             "the table; rewrites the table once per column, so only use it to drop a few columns. "
+                             "Needs about as much extra disk as the rebuild")
     parser.add_argument("--backup", action="store_true", 
                         help="Create a backup of the database before making changes")
     parser.add_argument("--columns-file", 
@@ -238,7 +401,12 @@ def main():
         print(f"Error: Columns file '{columns_file}' does not exist.")
         sys.exit(1)
     
-    print(f"Starting process with batch size: {args.batch_size:,}")
+    if args.batched:
+        print(f"Starting process with batch size: {args.batch_size:,}")
+    elif args.in_place:
+        print("Starting process, dropping columns in place")
+    else:
+        print("Starting process with a single bulk copy")
     if args.backup:
         print("Will create a backup before proceeding")
     
@@ -248,7 +416,8 @@ def main():
     
     # Drop unused columns
     success = drop_unused_columns(args.db_path, args.table_name, columns_to_keep, 
-                                 batch_size=args.batch_size, create_backup_file=args.backup)
+                                 batch_size=args.batch_size, create_backup_file=args.backup,
+                                 batched=args.batched, in_place=args.in_place)
     if not success:
         sys.exit(1)
 
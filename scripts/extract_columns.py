@@ -1,37 +1,58 @@
 
 import sqlite3, csv, sys, os
+from contextlib import closing
 
 db = r"E:\OSSI\EDA_on_CAC\datasrc\cac-combined.db"
 table = "organizations_old"
 out = r"E:\OSSI\EDA_on_CAC\out\organizations_columns_samples.csv"
 
-conn = sqlite3.connect(db)
-if conn is None:
-    print("Failed to connect to database")
-    sys.exit(1)
-cur = conn.cursor()
+def quote_identifier(ident):
+    """Quote a table or column name for interpolation into SQL."""
+    return '"' + ident.replace('"', '""') + '"'
 
-# verify table exists
-cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
-if not cur.fetchone():
-    print("Table not found:", table); sys.exit(1)
+# closing() releases the connection, the inner conn block ends the transaction
+with closing(sqlite3.connect(db)) as conn, conn:
+    cur = conn.cursor()
 
-# get columns
-cur.execute(f"PRAGMA table_info('{table}')")
-cols = cur.fetchall()  # cid, name, type, notnull, dflt_value, pk
+    # verify table exists
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    if not cur.fetchone():
+        print("Table not found:", table); sys.exit(1)
+
+    # get columns
+    cur.execute(f"PRAGMA table_info({quote_identifier(table)})")
+    cols = cur.fetchall()  # cid, name, type, notnull, dflt_value, pk
+
+    col_names = [c[1] for c in cols]
+
+    # sample one non-null value per column: first from a single scan of the
+    # leading rows, then one combined query for columns still empty there
+    samples = {}
+    try:
+        cur.execute(f"SELECT {', '.join(quote_identifier(name) for name in col_names)} "
+                    f"FROM {quote_identifier(table)} LIMIT 200")
+        for row in cur:
+            for name, value in zip(col_names, row):
+                if value is not None and name not in samples:
+                    samples[name] = value
+            if len(samples) == len(col_names):
+                break
+
+        missing = [name for name in col_names if name not in samples]
+        if missing:
+            cur.execute("SELECT " + ", ".join(
+                f"(SELECT {quote_identifier(name)} FROM {quote_identifier(table)} "
+                f"WHERE {quote_identifier(name)} IS NOT NULL LIMIT 1)" for name in missing))
+            for name, value in zip(missing, cur.fetchone()):
+                samples[name] = value if value is not None else ""
+    except Exception as e:
+        for name in col_names:
+            samples.setdefault(name, f"<error: {e}>")
 
 with open(out, 'w', newline='', encoding='utf-8') as f:
     w = csv.writer(f)
     w.writerow(["column","type","notnull","dflt_value","pk","sample"])
     for cid, name, ctype, notnull, dflt, pk in cols:
-        # sample one non-null value
-        try:
-            cur.execute(f"SELECT {name} FROM {table} WHERE {name} IS NOT NULL LIMIT 1")
-            row = cur.fetchone()
-            sample = row[0] if row else ""
-        except Exception as e:
-            sample = f"<error: {e}>"
-        w.writerow([name, ctype, notnull, dflt, pk, sample])
-
-conn.close()
+        w.writerow([name, ctype, notnull, dflt, pk, samples[name]])
+
 print("Wrote", out)